@@ -1,22 +1,122 @@
 import sys
 import json
 import time
+import hashlib
+import threading
+from collections import OrderedDict
+from html import escape
+
 import requests
+
+from shared_session import get_session
+
+try:
+    import orjson  # C实现的JSON解析器，解析速度约为标准库的2-3倍
+except ImportError:
+    orjson = None
+
+# ijson（增量JSON解析器，可选依赖）只在超大响应时用到，
+# 推迟到首次需要时再导入，不让它拖慢冷启动
+ijson = None
+_ijson_checked = False
+
+
+def _get_ijson():
+    """惰性导入ijson，结果缓存在模块全局里"""
+    global ijson, _ijson_checked
+    if not _ijson_checked:
+        _ijson_checked = True
+        try:
+            import ijson as _ijson
+            ijson = _ijson
+        except ImportError:
+            ijson = None
+    return ijson
+
+# 支持的模型列表，模块级常量，UI和默认值共用一份
+SUPPORTED_MODELS = ("deepseek-chat", "deepseek-coder", "deepseek-vision")
+
+# SSE流解析用的bytes常量，提到模块级避免热循环里每次重建
+_SSE_DATA_PREFIX = b"data: "
+_SSE_DATA_PREFIX_LEN = len(_SSE_DATA_PREFIX)
+_SSE_DATA_BARE = b"data:"  # SSE规范允许冒号后不带空格
+_SSE_DATA_BARE_LEN = len(_SSE_DATA_BARE)
+_SSE_DONE = b"[DONE]"
 from typing import Dict, Any, Optional, List, Union
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QTextEdit, QLineEdit, QPushButton,
                              QLabel, QComboBox, QSpinBox, QMessageBox, QTabWidget,QCheckBox)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import (Qt, QObject, QRunnable, QThreadPool, QTimer,
+                          pyqtSignal)
 from PyQt5.QtGui import QTextCursor
 
 
-class ApiRequestThread(QThread):
-    """API请求线程，用于在后台执行网络请求"""
-    finished = pyqtSignal(dict)
+def _iter_raw_chunks(response):
+    """尽量直接从response.raw用read1取数据
+
+    read1拿到多少返回多少，不像iter_content还要经过requests自己的
+    缓冲层等凑块，网络慢时首token能更早到达；旧版urllib3没有read1
+    时回退到iter_content。
+    """
+    raw = getattr(response, "raw", None)
+    if raw is not None and hasattr(raw, "read1"):
+        raw.decode_content = True
+        while True:
+            chunk = raw.read1(8192)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from response.iter_content(chunk_size=None)
+
+
+def _iter_sse_data(response):
+    """增量切分SSE流，产出各data:行的载荷bytes
+
+    自己维护一个bytearray缓冲按换行切分，绕开iter_lines的二次缓冲；
+    整个过程不产生中间str，载荷bytes可直接交给orjson。
+    """
+    buffer = bytearray()
+    for chunk in _iter_raw_chunks(response):
+        if not chunk:
+            continue
+        buffer.extend(chunk)
+        while True:
+            idx = buffer.find(b"\n")
+            if idx < 0:
+                break
+            line = bytes(buffer[:idx]).rstrip(b"\r")
+            del buffer[:idx + 1]
+            # 精确匹配前缀后按定长切片，绝不能用lstrip(b"data: ")——
+            # lstrip把参数当字符集合，会吃掉载荷开头的d/a/t/:/空格
+            if line.startswith(_SSE_DATA_PREFIX):
+                yield line[_SSE_DATA_PREFIX_LEN:]
+            elif line.startswith(_SSE_DATA_BARE):
+                yield line[_SSE_DATA_BARE_LEN:].lstrip(b" ")
+
+
+class ApiRequestSignals(QObject):
+    """ApiRequestRunnable的信号桥：QRunnable不是QObject，信号挂在这里
+
+    done在任务收尾时必发（无论成败），供任务登记表做清理。
+    """
+    completed = pyqtSignal(dict)
+    # 聊天任务只回传抽取好的回复文本，跨线程不用搬整个响应dict
+    reply = pyqtSignal(str)
     error = pyqtSignal(str)
+    done = pyqtSignal()
+
+
+class ApiRequestRunnable(QRunnable):
+    """API请求任务，在全局线程池的复用线程里执行网络请求
+
+    相比一次请求起一个QThread，线程池复用工作线程，
+    省掉每次约8MB的线程栈和线程创建开销，并发量也有上限。
+    """
 
     def __init__(self, client, endpoint, data):
         super().__init__()
+        self.signals = ApiRequestSignals()
         self.client = client
         self.endpoint = endpoint
         self.data = data
@@ -24,9 +124,100 @@ class ApiRequestThread(QThread):
     def run(self):
         try:
             response = self.client.post(self.endpoint, data=self.data)
-            self.finished.emit(response)
+            # 回复内容的抽取在工作线程完成，UI线程只收最终文本
+            if "choices" in response and len(response["choices"]) > 0:
+                self.signals.reply.emit(response["choices"][0]["message"]["content"])
+            else:
+                self.signals.error.emit(f"收到的响应格式不正确: {response}")
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.done.emit()
+
+
+class ConnectionTestRunnable(QRunnable):
+    """连接测试任务：DNS+TLS握手可能很慢，不能在UI线程上做"""
+
+    def __init__(self, client):
+        super().__init__()
+        self.signals = ApiRequestSignals()
+        self.client = client
+
+    def run(self):
+        try:
+            self.signals.completed.emit(self.client.get("/models"))
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.done.emit()
+
+
+class StreamRequestSignals(QObject):
+    """StreamRequestRunnable的信号桥"""
+    chunk = pyqtSignal(str)
+    completed = pyqtSignal(str)
+    error = pyqtSignal(str)
+    done = pyqtSignal()
+
+
+class StreamRequestRunnable(QRunnable):
+    """流式API请求任务，在线程池里逐段接收回复"""
+
+    def __init__(self, client, model, messages):
+        super().__init__()
+        self.signals = StreamRequestSignals()
+        self.client = client
+        self.model = model
+        self.messages = messages
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """协作式取消：下一个chunk边界自然退出
+
+        绝不能用QThread.terminate()硬杀——会泄漏socket、破坏SSL状态，
+        连接也无法归还连接池；协作退出让生成器的finally正常关闭响应。
+        """
+        self._cancelled.set()
+
+    # 发射端合并窗口：每个token都emit一次跨线程排队调用太浪费，
+    # 攒约30ms再发，和UI侧的定时刷新(约30Hz)正好对齐
+    EMIT_INTERVAL = 0.03
+
+    def run(self):
+        parts = []
+        pending = []
+        # 每个chunk都要用的方法提前绑定成局部变量，
+        # 循环里省掉重复的实例属性/模块属性查找
+        parts_append = parts.append
+        pending_append = pending.append
+        emit_chunk = self.signals.chunk.emit
+        monotonic = time.monotonic
+        interval = self.EMIT_INTERVAL
+        last_emit = monotonic()
+        cancelled = self._cancelled.is_set
+        try:
+            for content in self.client.stream_chat(self.model, self.messages):
+                if cancelled():
+                    break
+                parts_append(content)
+                pending_append(content)
+                now = monotonic()
+                if now - last_emit >= interval:
+                    emit_chunk("".join(pending))
+                    pending.clear()
+                    last_emit = now
+            # 已取消的任务只发done：排队中的chunk/completed会在
+            # 新对话重置之后才被主线程处理，把旧回复写进新会话
+            if cancelled():
+                return
+            if pending:
+                emit_chunk("".join(pending))
+            self.signals.completed.emit("".join(parts))
         except Exception as e:
-            self.error.emit(str(e))
+            if not cancelled():
+                self.signals.error.emit(str(e))
+        finally:
+            self.signals.done.emit()
 
 
 class AIApiClient:
@@ -50,16 +241,60 @@ class AIApiClient:
         self.max_retries = max_retries
         self.retry_delay = retry_delay
 
-    def _prepare_headers(self, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
-        final_headers = headers or {}
-
-        if "Content-Type" not in final_headers:
-            final_headers["Content-Type"] = "application/json"
+        # 请求体模板：热路径上copy()一个小dict比重建dict字面量更快
+        self._payload_template: Dict[str, Any] = {"model": None, "messages": None, "stream": False}
+
+        # temperature≈0时回复是确定性的，可以用LRU缓存把重放请求变成一次dict查找
+        self._response_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        self.cache_max_entries = 128
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # single-flight登记表：相同请求已在途时，后来者等首个结果而不是再发一遍
+        # 表项为[Event, 结果, 异常]
+        self._inflight: Dict[bytes, list] = {}
+        self._inflight_lock = threading.Lock()
+
+        # 认证头在构造时算好，避免每次请求重建dict和拼接f-string
+        prefix = f"{api_key_prefix} " if api_key_prefix else ""
+        self._default_headers = {
+            "Content-Type": "application/json",
+            api_key_header: f"{prefix}{api_key}",
+        }
 
+        # Session由shared_session按(主机,认证头)在进程内共享：
+        # keep-alive连接池跨客户端复用，重试由挂在适配器上的urllib3.Retry
+        # 在连接池层处理（重试间复用连接、遵守Retry-After）。
+        # 默认头直接挂在Session上，请求时连dict合并都省掉
+        self.session = get_session(
+            base_url,
+            headers=tuple(self._default_headers.items()),
+            max_retries=max_retries,
+            retry_delay=retry_delay,
+        )
+
+    def set_api_key(self, api_key: str) -> None:
+        """更换API密钥：更新认证头并切换到新密钥对应的共享Session
+
+        共享Session按认证头注册，绝不能原地改写它的headers——
+        注册表里同一个实例还可能被旧密钥的其他客户端拿到。
+        这里按新头重新取Session（旧Session留给旧密钥的持有者），
+        两个密钥只差认证串时，urllib3连接池里的TLS连接互不相干。
+        """
+        self.api_key = api_key
         prefix = f"{self.api_key_prefix} " if self.api_key_prefix else ""
-        final_headers[self.api_key_header] = f"{prefix}{self.api_key}"
+        self._default_headers[self.api_key_header] = f"{prefix}{api_key}"
+        self.session = get_session(
+            self.base_url,
+            headers=tuple(self._default_headers.items()),
+            max_retries=self.max_retries,
+            retry_delay=self.retry_delay,
+        )
 
-        return final_headers
+    def _prepare_headers(self, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        if headers is None:
+            return self._default_headers
+        return {**self._default_headers, **headers}
 
     def _make_request(
             self,
@@ -72,62 +307,266 @@ class AIApiClient:
             stream: bool = False
     ) -> Dict[str, Any]:
         url = f"{self.base_url}{endpoint}"
-        headers = self._prepare_headers(headers)
+        # 默认头已在Session上，只有调用方显式传headers时才需要合并
+        if headers is not None:
+            headers = self._prepare_headers(headers)
 
-        if data and headers.get("Content-Type") == "application/json" and not files:
+        content_type = (headers or self._default_headers).get("Content-Type")
+        if data and content_type == "application/json" and not files:
             if isinstance(data, dict):
-                data = json.dumps(data)
+                # orjson直接产出bytes，比json.dumps快且省掉requests内部的str->bytes编码
+                data = orjson.dumps(data) if orjson is not None else json.dumps(data)
 
-        for attempt in range(self.max_retries):
-            try:
-                response = requests.request(
-                    method=method,
-                    url=url,
-                    params=params,
-                    data=data,
-                    headers=headers,
-                    files=files,
-                    timeout=self.timeout,
-                    stream=stream
-                )
-
-                if 200 <= response.status_code < 300:
-                    if stream:
-                        return response
-                    else:
-                        try:
-                            return response.json()
-                        except json.JSONDecodeError:
-                            return {"text": response.text}
-                elif response.status_code in [429, 500, 502, 503, 504]:
-                    print(f"请求失败，状态码: {response.status_code}，尝试重试 ({attempt + 1}/{self.max_retries})")
-                    time.sleep(self.retry_delay * (2 ** attempt))
-                    continue
-                else:
-                    raise Exception(f"API请求失败: {response.status_code} - {response.text}")
-
-            except requests.exceptions.RequestException as e:
-                print(f"请求异常: {e}，尝试重试 ({attempt + 1}/{self.max_retries})")
-                time.sleep(self.retry_delay * (2 ** attempt))
+        try:
+            response = self.session.request(
+                method=method,
+                url=url,
+                params=params,
+                data=data,
+                headers=headers,
+                files=files,
+                timeout=self.timeout,
+                # 统一用stream=True，非流式调用分块读取响应体，
+                # 避免requests预读整个body再复制一份的峰值内存
+                stream=True
+            )
+        except requests.exceptions.RetryError as e:
+            raise Exception(f"达到最大重试次数后请求仍然失败: {e}") from e
 
-        raise Exception("达到最大重试次数后请求仍然失败")
+        if 200 <= response.status_code < 300:
+            if stream:
+                return response
+            body = b"".join(response.iter_content(chunk_size=64 * 1024))
+            try:
+                # 直接解析bytes，跳过response.text的一次utf-8解码
+                if orjson is not None:
+                    return orjson.loads(body)
+                return json.loads(body)
+            except ValueError:
+                return {"text": body.decode("utf-8", errors="replace")}
+
+        raise Exception(f"API请求失败: {response.status_code} - {response.text}")
+
+    @staticmethod
+    def _request_fingerprint(endpoint: str, data: Dict[str, Any]) -> bytes:
+        """请求指纹：endpoint+按键排序的载荷的blake2b摘要"""
+        raw = (orjson.dumps(data, option=orjson.OPT_SORT_KEYS) if orjson is not None
+               else json.dumps(data, sort_keys=True).encode())
+        return hashlib.blake2b(endpoint.encode() + raw, digest_size=16).digest()
+
+    def _deterministic_cache_key(self, endpoint: str, data: Any) -> Optional[bytes]:
+        """仅对确定性请求（temperature≈0且非流式）生成缓存键"""
+        if not isinstance(data, dict):
+            return None
+        if data.get("stream") or data.get("temperature", 1.0) > 0.001:
+            return None
+        return self._request_fingerprint(endpoint, data)
+
+    def cache_stats(self) -> Dict[str, int]:
+        """返回缓存命中统计"""
+        return {"hits": self._cache_hits, "misses": self._cache_misses,
+                "entries": len(self._response_cache)}
+
+    def clear_cache(self) -> None:
+        """清空响应缓存"""
+        self._response_cache.clear()
 
     def post(self, endpoint: str, data: Optional[Union[Dict[str, Any], str]] = None, **kwargs) -> Dict[str, Any]:
-        return self._make_request("POST", endpoint, data=data, **kwargs)
+        cache_key = None
+        if not kwargs.get("stream"):
+            cache_key = self._deterministic_cache_key(endpoint, data)
+            if cache_key is not None:
+                cached = self._response_cache.get(cache_key)
+                if cached is not None:
+                    self._cache_hits += 1
+                    self._response_cache.move_to_end(cache_key)
+                    return cached
+                self._cache_misses += 1
+
+        # single-flight：相同请求已在途时，后来的线程等首个结果，不再发一遍。
+        # 覆盖"缓存未命中但请求已在飞"的窗口期（如用户快速重复点发送）
+        sf_entry = None
+        sf_key = None
+        if not kwargs.get("stream") and isinstance(data, dict) and not data.get("stream"):
+            # 确定性请求刚算过缓存键，直接复用，不再序列化+哈希第二遍
+            sf_key = cache_key if cache_key is not None else self._request_fingerprint(endpoint, data)
+            with self._inflight_lock:
+                sf_entry = self._inflight.get(sf_key)
+                if sf_entry is not None:
+                    is_leader = False
+                else:
+                    sf_entry = [threading.Event(), None, None]
+                    self._inflight[sf_key] = sf_entry
+                    is_leader = True
+            if not is_leader:
+                sf_entry[0].wait()
+                if sf_entry[2] is not None:
+                    raise sf_entry[2]
+                return sf_entry[1]
+
+        try:
+            response = self._make_request("POST", endpoint, data=data, **kwargs)
+        except Exception as e:
+            if sf_entry is not None:
+                sf_entry[2] = e
+                with self._inflight_lock:
+                    self._inflight.pop(sf_key, None)
+                sf_entry[0].set()
+            raise
+
+        if sf_entry is not None:
+            sf_entry[1] = response
+            with self._inflight_lock:
+                self._inflight.pop(sf_key, None)
+            sf_entry[0].set()
+
+        if cache_key is not None and isinstance(response, dict):
+            self._response_cache[cache_key] = response
+            if len(self._response_cache) > self.cache_max_entries:
+                self._response_cache.popitem(last=False)
+        return response
 
     def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
         """发送GET请求"""
         return self._make_request("GET", endpoint, params=params, **kwargs)
 
+    def chat(
+            self,
+            model: str,
+            messages: List[Dict[str, str]],
+            endpoint: str = "/chat/completions",
+            **params: Any
+    ) -> str:
+        """发送一次对话请求，只返回回复内容
+
+        响应体超过100KB且装了ijson时走增量解析，只抽取
+        choices[0].message.content，不为usage/logprobs等会被丢弃的
+        字段构建完整对象树。
+        """
+        data = self._payload_template.copy()
+        data["model"] = model
+        data["messages"] = messages
+        data.update(params)
+
+        if _get_ijson() is not None:
+            response = self.post(endpoint, data=data, stream=True)
+            try:
+                if int(response.headers.get("Content-Length") or 0) > 100_000:
+                    # raw流默认不解压，而大响应恰恰最可能被gzip过；
+                    # 打开透明解压，ijson才能拿到明文JSON
+                    response.raw.decode_content = True
+                    try:
+                        return next(ijson.items(response.raw, "choices.item.message.content"))
+                    except StopIteration:
+                        raise Exception("API响应中缺少choices内容") from None
+                body = response.content
+            finally:
+                response.close()
+            parsed = orjson.loads(body) if orjson is not None else json.loads(body)
+            return parsed["choices"][0]["message"]["content"]
+
+        response = self.post(endpoint, data=data)
+        return response["choices"][0]["message"]["content"]
+
+    def stream_chat(
+            self,
+            model: str,
+            messages: List[Dict[str, str]],
+            endpoint: str = "/chat/completions",
+            **params: Any
+    ):
+        """流式对话，逐段产出回复内容
+
+        SSE行保持bytes处理：前缀判断、切片、JSON解析都不经过str，
+        省掉长回复里上千次小块的utf-8解码开销。
+        """
+        data = self._payload_template.copy()
+        data["model"] = model
+        data["messages"] = messages
+        data["stream"] = True
+        data.update(params)
+        response = self.post(endpoint, data=data, stream=True)
+        # 热循环里跑上千次，把常用函数绑定到局部变量减少查找开销
+        loads = orjson.loads if orjson is not None else json.loads
+        try:
+            for payload in _iter_sse_data(response):
+                if payload == _SSE_DONE:
+                    break
+                # 响应结构是固定契约，直接索引比逐层.get()少一半字典查找
+                content = loads(payload)["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
+        finally:
+            response.close()
+
+    def chat_batch(
+            self,
+            model: str,
+            messages: List[Dict[str, str]],
+            n: int = 1,
+            endpoint: str = "/chat/completions",
+            **params: Any
+    ) -> List[str]:
+        """单次请求获取同一组消息的n个补全，省去n-1次HTTP往返
+
+        服务端可在n个补全间共享分词和prefill，choices按index排序后返回内容列表。
+        """
+        data = {"model": model, "messages": messages, "n": n}
+        data.update(params)
+        response = self.post(endpoint, data=data)
+        choices = sorted(response.get("choices", []), key=lambda c: c.get("index", 0))
+        return [choice["message"]["content"] for choice in choices]
+
+    def completions_batch(
+            self,
+            model: str,
+            prompts: List[str],
+            endpoint: str = "/completions",
+            **params: Any
+    ) -> List[str]:
+        """把多个独立prompt合并成一次completions请求
+
+        兼容OpenAI风格的列表prompt参数，返回结果按choice["index"]对应回输入顺序。
+        """
+        data = {"model": model, "prompt": prompts}
+        data.update(params)
+        response = self.post(endpoint, data=data)
+        results = [""] * len(prompts)
+        for choice in response.get("choices", []):
+            results[choice.get("index", 0)] = choice.get("text", "")
+        return results
+
+
+class DeepSeekClient(AIApiClient):
+    """预置DeepSeek接入参数的薄封装
+
+    HTTP层的全部机制（共享Session、重试、orjson、响应缓存、
+    single-flight）只存在于AIApiClient一处；按提供方特化的子类
+    只携带默认配置，不复制任何请求逻辑。
+    """
+
+    DEFAULT_BASE_URL = "https://api.deepseek.com/v1"
+
+    def __init__(self, api_key: str, base_url: str = DEFAULT_BASE_URL, **kwargs):
+        super().__init__(base_url=base_url, api_key=api_key, **kwargs)
+
 
 class Conversation:
     """对话管理类"""
 
-    def __init__(self, model: str = "deepseek-chat"):
+    def __init__(self, model: str = SUPPORTED_MODELS[0]):
         self.model = model
         self.history = []
         self.turn_count = 0
         self.max_turns = 0  # 0表示无限制
+        self.max_context_tokens = 8000  # 0表示不裁剪
+
+        # 重发相同问题（重新生成/回退）时的回放缓存：
+        # 键是(model, 当前待发送历史)的hash，值是上次成功的回复
+        self._reply_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self.reply_cache_max = 128
+        # 历史很长时几乎不可能逐字节重复，缓存只会被污染，直接跳过
+        self.reply_cache_history_limit = 20
 
     def start_new(self, model: Optional[str] = None) -> None:
         """开始新对话"""
@@ -144,11 +583,64 @@ class Conversation:
         """添加AI回复"""
         self.history.append({"role": "assistant", "content": message})
         self.turn_count += 1
+        self._prune_history()
+
+    @staticmethod
+    def _estimate_tokens(message: Dict[str, str]) -> int:
+        """粗略估算单条消息的token数（约4字符/token）"""
+        return len(message.get("content", "")) // 4 + 4
+
+    def _prune_history(self) -> None:
+        """超出token预算时一次性裁剪到低水位，保留开头的system消息
+
+        不裁剪的话每一轮都会重发全部历史，单轮成本随轮数线性增长。
+        裁剪是延迟批量进行的：服务端的prompt前缀缓存要求历史逐字节
+        一致才命中，如果每轮都从头部裁一点，前缀每轮都变、每轮都要
+        全量prefill。攒到超预算后一次裁到约75%低水位，两次裁剪之间
+        的所有轮次历史保持append-only，前缀缓存都能命中。
+        """
+        if not self.max_context_tokens:
+            return
+        start = 1 if self.history and self.history[0]["role"] == "system" else 0
+        total = sum(self._estimate_tokens(msg) for msg in self.history)
+        if total <= self.max_context_tokens:
+            return
+        low_watermark = self.max_context_tokens * 3 // 4
+        while total > low_watermark and len(self.history) > start + 1:
+            total -= self._estimate_tokens(self.history.pop(start))
 
     def get_messages(self) -> List[Dict[str, str]]:
         """获取所有消息"""
         return self.history
 
+    def _reply_cache_key(self) -> Optional[bytes]:
+        """基于当前待发送历史计算缓存键，历史过长时返回None"""
+        if not self.history or len(self.history) > self.reply_cache_history_limit:
+            return None
+        payload = {"m": self.model, "h": self.history}
+        raw = (orjson.dumps(payload) if orjson is not None
+               else json.dumps(payload, ensure_ascii=False).encode())
+        return hashlib.blake2b(raw, digest_size=16).digest()
+
+    def cached_reply(self) -> Optional[str]:
+        """查询当前历史是否有可回放的历史回复"""
+        key = self._reply_cache_key()
+        if key is None:
+            return None
+        reply = self._reply_cache.get(key)
+        if reply is not None:
+            self._reply_cache.move_to_end(key)
+        return reply
+
+    def store_reply(self, reply: str) -> None:
+        """记录本轮回复（须在add_assistant_message之前调用）"""
+        key = self._reply_cache_key()
+        if key is None:
+            return
+        self._reply_cache[key] = reply
+        if len(self._reply_cache) > self.reply_cache_max:
+            self._reply_cache.popitem(last=False)
+
     def can_continue(self) -> bool:
         """检查是否可以继续对话"""
         return self.max_turns == 0 or self.turn_count < self.max_turns
@@ -161,14 +653,84 @@ class Conversation:
 class AIChatApp(QMainWindow):
     """AI聊天应用主窗口"""
 
+    # 绑定成类属性，省去热路径上每次穿过Qt模块属性查找
+    _END = QTextCursor.End
+
     def __init__(self):
         super().__init__()
 
         self.client = None
+        self._client_signature = None  # 生成client时的配置快照，用于判断是否需要重建
         self.conversation = Conversation()
 
+        # 全局线程池复用工作线程并限制并发数，防止快速连发时线程爆炸
+        self.pool = QThreadPool.globalInstance()
+        self.pool.setMaxThreadCount(4)
+        # 在途任务引用，保活其信号桥QObject直到任务结束
+        self.active_tasks: List[QRunnable] = []
+
+        # 流式回复先入缓冲，由定时器按约30Hz批量写入UI：
+        # 每个token都insertText会触发一次文档重排，快速流下UI明显卡顿
+        self._stream_buffer: List[str] = []
+        # 流式插入位置用持久化QTextCursor记住：insertText后游标自动前移，
+        # 不用每次刷新都重新取textCursor()再movePosition到文档末尾
+        self._stream_cursor: Optional[QTextCursor] = None
+        self._stream_timer = QTimer(self)
+        self._stream_timer.setInterval(33)
+        self._stream_timer.timeout.connect(self._flush_stream_buffer)
+
         self.init_ui()
 
+    def _submit_task(self, task: QRunnable) -> None:
+        """提交任务到线程池，并保活引用到任务结束
+
+        信号桥QObject必须活到done发出，否则回调会静默丢失；
+        结束立刻移除，引用列表不会随发送次数增长。
+        """
+        self.active_tasks.append(task)
+        task.signals.done.connect(lambda t=task: self._reap_task(t))
+        self.pool.start(task)
+
+    def _reap_task(self, task: QRunnable) -> None:
+        """后台任务结束后的清理"""
+        try:
+            self.active_tasks.remove(task)
+        except ValueError:
+            pass
+
+    def closeEvent(self, event) -> None:
+        """窗口关闭时先取消在途任务，再等线程池收尾
+
+        不等待就退出会在工作线程仍在跑时销毁Qt对象；
+        取消信号让流式任务在下一个分块边界退出，等待时间很短。
+        """
+        self._cancel_active_tasks()
+        self._stream_timer.stop()
+        self.pool.waitForDone(3000)
+        super().closeEvent(event)
+
+    def _get_client(self) -> AIApiClient:
+        """按当前配置复用API客户端，配置未变时不重建
+
+        每次重建都会丢弃Session连接池里已建立的TLS连接，
+        下一次请求就得重新握手。
+        """
+        signature = (
+            self.url_input.text(),
+            self.key_input.text(),
+            self.header_input.text(),
+            self.prefix_input.text(),
+        )
+        if self.client is None or signature != self._client_signature:
+            self.client = AIApiClient(
+                base_url=signature[0],
+                api_key=signature[1],
+                api_key_header=signature[2],
+                api_key_prefix=signature[3],
+            )
+            self._client_signature = signature
+        return self.client
+
     def init_ui(self) -> None:
         """初始化用户界面"""
         self.setWindowTitle("DeepSeek AI聊天助手")
@@ -271,7 +833,7 @@ class AIChatApp(QMainWindow):
         # 模型选择 - 预设DeepSeek模型
         model_label = QLabel("模型:")
         self.model_combo = QComboBox()
-        self.model_combo.addItems(["deepseek-chat", "deepseek-coder", "deepseek-vision"])
+        self.model_combo.addItems(SUPPORTED_MODELS)
         settings_layout.addWidget(model_label)
         settings_layout.addWidget(self.model_combo)
 
@@ -284,6 +846,15 @@ class AIChatApp(QMainWindow):
         settings_layout.addWidget(turns_label)
         settings_layout.addWidget(self.turns_spin)
 
+        # 流式输出开关
+        self.stream_checkbox = QCheckBox("流式输出")
+        self.stream_checkbox.setChecked(True)
+        settings_layout.addWidget(self.stream_checkbox)
+
+        # 回复缓存开关：重发相同问题时直接回放上次回复，不再请求
+        self.reply_cache_checkbox = QCheckBox("回复缓存")
+        settings_layout.addWidget(self.reply_cache_checkbox)
+
         # 新对话按钮
         self.new_chat_button = QPushButton("开始新对话")
         self.new_chat_button.clicked.connect(self.start_new_chat)
@@ -295,6 +866,9 @@ class AIChatApp(QMainWindow):
         self.chat_history = QTextEdit()
         self.chat_history.setReadOnly(True)
         self.chat_history.setAcceptRichText(True)
+        # 封顶文档块数：长时间挂机聊天时最旧的段落O(1)淘汰，
+        # 不然QTextDocument会把历史上所有token连带样式一直留在内存里
+        self.chat_history.document().setMaximumBlockCount(5000)
         layout.addWidget(self.chat_history)
 
         # 输入区域
@@ -313,33 +887,51 @@ class AIChatApp(QMainWindow):
         return tab
 
     def test_api_connection(self) -> None:
-        """测试API连接"""
-        try:
-            # 创建API客户端
-            self.client = AIApiClient(
-                base_url=self.url_input.text(),
-                api_key=self.key_input.text(),
-                api_key_header=self.header_input.text(),
-                api_key_prefix=self.prefix_input.text()
-            )
-
-            # 测试请求
-            self.status_label.setText("测试中...")
-            response = self.client.get("/models")
+        """测试API连接（请求在后台线程执行，结果通过信号回传）"""
+        # 获取（或复用）API客户端
+        self.client = self._get_client()
+
+        self.status_label.setText("测试中...")
+        self.test_button.setEnabled(False)
+
+        test_task = ConnectionTestRunnable(self.client)
+        test_task.signals.completed.connect(self._on_test_success)
+        test_task.signals.error.connect(self._on_test_failed)
+        self._submit_task(test_task)
+
+    def _on_test_success(self, response: Dict[str, Any]) -> None:
+        """连接测试成功返回"""
+        self.test_button.setEnabled(True)
+        if "models" in str(response) or "data" in response:
+            self.status_label.setText("连接成功")
+            QMessageBox.information(self, "成功", "API连接测试成功!")
+        else:
+            self.status_label.setText("连接失败")
+            QMessageBox.warning(self, "失败", f"API返回意外响应: {response}")
 
-            if "models" in str(response) or "data" in response:
-                self.status_label.setText("连接成功")
-                QMessageBox.information(self, "成功", "API连接测试成功!")
-            else:
-                self.status_label.setText("连接失败")
-                QMessageBox.warning(self, "失败", f"API返回意外响应: {response}")
+    def _on_test_failed(self, error: str) -> None:
+        """连接测试失败"""
+        self.test_button.setEnabled(True)
+        self.status_label.setText("连接失败")
+        QMessageBox.critical(self, "错误", f"连接测试失败: {error}")
 
-        except Exception as e:
-            self.status_label.setText("连接失败")
-            QMessageBox.critical(self, "错误", f"连接测试失败: {str(e)}")
+    def _cancel_active_tasks(self) -> None:
+        """协作式取消所有在途任务（目前只有流式任务支持取消）"""
+        for task in self.active_tasks:
+            cancel = getattr(task, "cancel", None)
+            if cancel is not None:
+                cancel()
 
     def start_new_chat(self) -> None:
         """开始新对话"""
+        self._cancel_active_tasks()
+        self._stream_timer.stop()
+        self._stream_buffer.clear()
+        self._stream_cursor = None
+        # 被取消的流只发done，不会再走completed/error的收尾路径，
+        # 输入控件要在这里解锁，否则会一直停在发送中状态
+        self.send_button.setEnabled(True)
+        self.message_input.setReadOnly(False)
         self.conversation.start_new(self.model_combo.currentText())
         self.conversation.set_max_turns(self.turns_spin.value())
         self.chat_history.clear()
@@ -363,52 +955,115 @@ class AIChatApp(QMainWindow):
             return
 
         # 添加用户消息到历史
+        # 用户输入先转义再拼HTML：既防注入，也避免QTextEdit把内容当标签解析
         self.conversation.add_user_message(message)
-        self.chat_history.append(f"<b>你:</b> {message}")
+        self.chat_history.append(f"<b>你:</b> {escape(message)}")
         self.message_input.clear()
 
-        # 准备请求数据
-        data = {
-            "model": self.conversation.model,
-            "messages": self.conversation.get_messages()
-        }
+        # 命中回放缓存时省掉整个HTTP往返
+        if self.reply_cache_checkbox.isChecked():
+            cached = self.conversation.cached_reply()
+            if cached is not None:
+                self.conversation.add_assistant_message(cached)
+                self.chat_history.append("<b>DeepSeek AI:</b> ")
+                cursor = self.chat_history.textCursor()
+                cursor.movePosition(self._END)
+                cursor.insertText(cached)
+                self.chat_history.setTextCursor(cursor)
+                return
 
         # 在后台线程中发送请求
         self.send_button.setEnabled(False)
         self.message_input.setReadOnly(True)
 
-        self.thread = ApiRequestThread(self.client, "/chat/completions", data)
-        self.thread.finished.connect(self.handle_api_response)
-        self.thread.error.connect(self.handle_api_error)
-        self.thread.start()
+        if self.stream_checkbox.isChecked():
+            # 流式：先写好发言人前缀，之后的内容按批次插到文档末尾
+            self.chat_history.append("<b>DeepSeek AI:</b> ")
+            cursor = self.chat_history.textCursor()
+            cursor.movePosition(self._END)
+            self._stream_cursor = cursor
+            self._stream_buffer.clear()
+            task = StreamRequestRunnable(
+                self._get_client(), self.conversation.model, self.conversation.get_messages())
+            task.signals.chunk.connect(self._on_stream_chunk)
+            task.signals.completed.connect(self.handle_stream_finished)
+            task.signals.error.connect(self.handle_api_error)
+            self._stream_timer.start()
+            self._submit_task(task)
+        else:
+            data = {
+                "model": self.conversation.model,
+                "messages": self.conversation.get_messages()
+            }
+            task = ApiRequestRunnable(self._get_client(), "/chat/completions", data)
+            task.signals.reply.connect(self.handle_api_response)
+            task.signals.error.connect(self.handle_api_error)
+            self._submit_task(task)
+
+    def _on_stream_chunk(self, content: str) -> None:
+        """接收流式片段：只入缓冲，由定时器批量刷新UI"""
+        self._stream_buffer.append(content)
+
+    def _flush_stream_buffer(self) -> None:
+        """把缓冲的流式片段一次性写入聊天记录"""
+        if not self._stream_buffer:
+            return
+        text = "".join(self._stream_buffer)
+        self._stream_buffer.clear()
+        cursor = self._stream_cursor
+        if cursor is None:
+            cursor = self.chat_history.textCursor()
+            cursor.movePosition(self._END)
+            self._stream_cursor = cursor
+        cursor.insertText(text)
+        # insertText已自动推进游标，不必每次flush都setTextCursor往
+        # C++侧拷贝一份；跟随滚动直接拉滚动条到底，代价更低
+        bar = self.chat_history.verticalScrollBar()
+        bar.setValue(bar.maximum())
+
+    def handle_stream_finished(self, full_reply: str) -> None:
+        """流式回复结束"""
+        self._stream_timer.stop()
+        self._flush_stream_buffer()
+        self._stream_cursor = None
+        self.send_button.setEnabled(True)
+        self.message_input.setReadOnly(False)
+
+        if self.reply_cache_checkbox.isChecked():
+            self.conversation.store_reply(full_reply)
+        self.conversation.add_assistant_message(full_reply)
+        if not self.conversation.can_continue():
+            self.chat_history.append("<b>=== 已达到最大对话轮数 ===</b>")
 
-    def handle_api_response(self, response: Dict[str, Any]) -> None:
-        """处理API响应"""
+    def handle_api_response(self, assistant_reply: str) -> None:
+        """处理API响应（工作线程已抽取好回复文本）"""
         self.send_button.setEnabled(True)
         self.message_input.setReadOnly(False)
 
-        if "choices" in response and len(response["choices"]) > 0:
-            assistant_reply = response["choices"][0]["message"]["content"]
-            self.conversation.add_assistant_message(assistant_reply)
-            self.chat_history.append(f"<b>DeepSeek AI:</b> {assistant_reply}")
+        if self.reply_cache_checkbox.isChecked():
+            self.conversation.store_reply(assistant_reply)
+        self.conversation.add_assistant_message(assistant_reply)
 
-            # 滚动到底部
-            cursor = self.chat_history.textCursor()
-            cursor.movePosition(QTextCursor.End)
-            self.chat_history.setTextCursor(cursor)
+        # 只有发言人前缀是HTML，正文用insertText按纯文本插入，
+        # 不经过HTML解析器，模型输出里的标签也不会被执行
+        self.chat_history.append("<b>DeepSeek AI:</b> ")
+        cursor = self.chat_history.textCursor()
+        cursor.movePosition(self._END)
+        cursor.insertText(assistant_reply)
+        self.chat_history.setTextCursor(cursor)
 
-            # 检查是否达到最大轮数
-            if not self.conversation.can_continue():
-                self.chat_history.append("<b>=== 已达到最大对话轮数 ===</b>")
-        else:
-            self.chat_history.append("<b>DeepSeek AI:</b> [无回复]")
-            QMessageBox.warning(self, "API响应", "收到的响应格式不正确")
+        # 检查是否达到最大轮数
+        if not self.conversation.can_continue():
+            self.chat_history.append("<b>=== 已达到最大对话轮数 ===</b>")
 
     def handle_api_error(self, error: str) -> None:
         """处理API错误"""
+        self._stream_timer.stop()
+        self._flush_stream_buffer()
+        self._stream_cursor = None
         self.send_button.setEnabled(True)
         self.message_input.setReadOnly(False)
-        self.chat_history.append(f"<b>错误:</b> {error}")
+        self.chat_history.append(f"<b>错误:</b> {escape(error)}")
         QMessageBox.critical(self, "API错误", f"请求失败: {error}")
 
 
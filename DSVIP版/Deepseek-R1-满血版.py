@@ -1,10 +1,12 @@
 import sys
 import time
-def typewriter_effect(text, delay=0.1):
-   for char in text:
-       sys.stdout.write(char)
+def typewriter_effect(text, delay=0.1, chunk=4):
+   # 按块输出：N次write+flush+sleep合并成N/chunk次，
+   # 每块睡眠按比例放大，总时长和视觉节奏基本不变
+   for i in range(0, len(text), chunk):
+       sys.stdout.write(text[i:i + chunk])
        sys.stdout.flush()
-       time.sleep(delay)
+       time.sleep(delay * chunk)
    print()
 print("我是DeepSeek，很高兴见到你")
 while True:
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import random
+import sys
+import time
+from typing import Dict, Any, Optional, List
+
+import httpx
+
+# 408/425也是瞬态错误，和429/5xx一样可以重试
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# 只有瞬态传输错误值得重试：超时和网络读写失败。
+# 协议错误/代理配置错/不支持的URL属于永久性失败，重试只是白等退避时间
+RETRYABLE_EXCEPTIONS = (httpx.TimeoutException, httpx.NetworkError)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class AsyncTokenBucket:
+    """令牌桶限流器，把并发请求平滑到给定的每分钟配额
+
+    客户端主动限速能避免asyncio.gather一次性打满配额后触发429风暴，
+    比事后指数退避重试省时得多。
+    """
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self.fill_rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """取走tokens个令牌，不足时等待补充"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.fill_rate)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD自适应并发控制，类似TCP拥塞控制
+
+    成功时加性增加在途请求上限，收到429/503时乘性减半，
+    让并发量自动收敛到服务端当前能承受的水平。
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 64):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self._active = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self) -> "AdaptiveConcurrencyLimiter":
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < int(self.limit))
+            self._active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def record_success(self) -> None:
+        """请求成功：每跑满一窗并发，上限约+1"""
+        if self.limit < self.maximum:
+            self.limit = min(self.limit + 1.0 / self.limit, self.maximum)
+
+    def record_overload(self) -> None:
+        """服务端过载（429/503）：上限减半"""
+        self.limit = max(self.limit / 2, float(self.minimum))
+
+
+class AsyncAIApiClient:
+    """AIApiClient的异步版本，基于httpx.AsyncClient
+
+    并发发出的多个请求可被服务端连续批处理（continuous batching），
+    吞吐量约为顺序调用的N倍。
+    """
+
+    def __init__(
+            self,
+            base_url: str,
+            api_key: str,
+            api_key_header: str = "Authorization",
+            api_key_prefix: str = "Bearer",
+            timeout: int = 60,
+            max_retries: int = 3,
+            retry_delay: int = 5,
+            requests_per_minute: int = 0,
+            http2: bool = True
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # 0表示不限速
+        self.rate_limiter = AsyncTokenBucket(requests_per_minute) if requests_per_minute else None
+        # chat_many大批量并发时自动调节在途请求数，避免触发提供方过载
+        self.concurrency_limiter = AdaptiveConcurrencyLimiter()
+
+        prefix = f"{api_key_prefix} " if api_key_prefix else ""
+        client_kwargs = dict(
+            base_url=base_url,
+            headers={
+                "Content-Type": "application/json",
+                api_key_header: f"{prefix}{api_key}",
+            },
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        )
+        try:
+            # HTTP/2在单个TLS连接上多路复用N个并发请求，省掉N-1次握手
+            # 需要httpx[http2]（h2包），未安装时自动回退HTTP/1.1
+            self.client = httpx.AsyncClient(http2=http2, **client_kwargs)
+        except ImportError:
+            self.client = httpx.AsyncClient(**client_kwargs)
+
+    def _retry_delay_seconds(self, attempt: int, retry_after: Optional[str]) -> float:
+        """优先采用服务端Retry-After，否则用满幅抖动的指数退避
+
+        满幅抖动(full jitter)：在[0, 上限]内均匀取值，并发协程的
+        重试时刻被完全打散，不会在同一瞬间集体重试造成雪崩式429。
+        """
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.retry_delay * (2 ** attempt), 30))
+
+    async def post(self, endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """发送POST请求并返回解析后的JSON，瞬态失败时异步退避重试"""
+        body = orjson.dumps(data) if orjson is not None else json.dumps(data).encode()
+        for attempt in range(self.max_retries):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            try:
+                async with self.concurrency_limiter:
+                    response = await self.client.post(endpoint, content=body)
+            except RETRYABLE_EXCEPTIONS:
+                if attempt + 1 >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._retry_delay_seconds(attempt, None))
+                continue
+            if response.status_code in (429, 503):
+                self.concurrency_limiter.record_overload()
+            elif response.is_success:
+                self.concurrency_limiter.record_success()
+            if response.status_code in RETRYABLE_STATUS and attempt + 1 < self.max_retries:
+                # asyncio.sleep只挂起当前协程，其他在途请求继续推进
+                await asyncio.sleep(
+                    self._retry_delay_seconds(attempt, response.headers.get("Retry-After")))
+                continue
+            response.raise_for_status()
+            if orjson is not None:
+                return orjson.loads(response.content)
+            return json.loads(response.content)
+        raise RuntimeError("达到最大重试次数后请求仍然失败")
+
+    async def chat(
+            self,
+            model: str,
+            messages: List[Dict[str, str]],
+            endpoint: str = "/chat/completions",
+            **params: Any
+    ) -> str:
+        """发送一次对话请求，返回回复内容"""
+        data = {"model": model, "messages": messages}
+        data.update(params)
+        response = await self.post(endpoint, data)
+        return response["choices"][0]["message"]["content"]
+
+    async def stream_chat(
+            self,
+            model: str,
+            messages: List[Dict[str, str]],
+            endpoint: str = "/chat/completions",
+            **params: Any
+    ):
+        """流式对话，逐段产出回复内容"""
+        data = {"model": model, "messages": messages, "stream": True}
+        data.update(params)
+        body = orjson.dumps(data) if orjson is not None else json.dumps(data).encode()
+        loads = orjson.loads if orjson is not None else json.loads
+        async with self.client.stream("POST", endpoint, content=body) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                payload = line[6:]
+                if payload == "[DONE]":
+                    break
+                content = loads(payload)["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
+
+    async def interactive_chat(self, model: str, system_prompt: Optional[str] = None) -> None:
+        """命令行交互式对话
+
+        input()是阻塞调用，放到线程池(asyncio.to_thread)执行，
+        事件循环在用户输入期间仍可推进后台请求和流式输出。
+        """
+        history: List[Dict[str, str]] = []
+        if system_prompt:
+            history.append({"role": "system", "content": system_prompt})
+        while True:
+            user_input = (await asyncio.to_thread(input, "你: ")).strip()
+            if user_input in ("exit", "quit", "退出"):
+                break
+            if not user_input:
+                continue
+            history.append({"role": "user", "content": user_input})
+            parts = []
+            # 每个token都flush等于每个token一次系统调用，这里按50ms节流，
+            # 一次flush可以带出几十到几百个token
+            last_flush = time.monotonic()
+            async for chunk in self.stream_chat(model, history):
+                sys.stdout.write(chunk)
+                parts.append(chunk)
+                now = time.monotonic()
+                if now - last_flush > 0.05:
+                    sys.stdout.flush()
+                    last_flush = now
+            print()
+            history.append({"role": "assistant", "content": "".join(parts)})
+
+    async def chat_many(
+            self,
+            model: str,
+            messages_list: List[List[Dict[str, str]]],
+            **params: Any
+    ) -> List[str]:
+        """并发发送多组独立对话，结果顺序与输入一致"""
+        return await asyncio.gather(
+            *[self.chat(model, messages, **params) for messages in messages_list]
+        )
+
+    async def aclose(self) -> None:
+        """关闭底层连接池"""
+        await self.client.aclose()
@@ -0,0 +1,73 @@
+"""进程级共享的requests会话池
+
+多个入口脚本/客户端访问同一主机时共用一个Session，
+keep-alive的TLS连接在整个进程内复用，而不是每个客户端各建一套连接池。
+"""
+import random
+import threading
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_sessions: Dict[tuple, requests.Session] = {}
+_lock = threading.Lock()
+
+# 单次退避封顶30秒，避免429风暴把工作线程冻住半分钟以上
+_BACKOFF_CAP = 30.0
+
+
+class _FullJitterRetry(Retry):
+    """满幅抖动(full jitter)版的重试退避
+
+    urllib3自带的backoff_jitter只在5s/10s/20s的确定性阶梯上
+    叠加最多1秒随机量，并发客户端的重试时刻仍然基本同步；
+    这里改成在[0, min(指数退避, 封顶)]内均匀取值，
+    同一批429的重试被彻底打散，不会再次集体打爆限额。
+    """
+
+    def get_backoff_time(self) -> float:
+        base = super().get_backoff_time()
+        if base <= 0:
+            return base
+        return random.uniform(0, min(base, _BACKOFF_CAP))
+
+
+def build_retry(max_retries: int = 3, retry_delay: int = 5) -> Retry:
+    """构造统一的重试策略：429/5xx满幅抖动指数退避，遵守Retry-After"""
+    return _FullJitterRetry(
+        total=max_retries,
+        backoff_factor=retry_delay,
+        status_forcelist=[408, 425, 429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        respect_retry_after_header=True,
+    )
+
+
+def get_session(
+        base_url: str,
+        headers: Tuple[Tuple[str, str], ...] = (),
+        max_retries: int = 3,
+        retry_delay: int = 5
+) -> requests.Session:
+    """按(主机, 默认头, 重试参数)复用Session
+
+    相同配置的客户端拿到同一个Session实例，共享其连接池；
+    认证头不同的客户端各自独立，互不串号。
+    """
+    key = (base_url, tuple(headers), max_retries, retry_delay)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                max_retries=build_retry(max_retries, retry_delay),
+                pool_connections=10,
+                pool_maxsize=32,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(dict(headers))
+            _sessions[key] = session
+        return session